@@ -0,0 +1,63 @@
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from api.constants import AUTH_TOKEN_CACHE_TIMEOUT
+
+
+# Поля пользователя, которые попадают в кеш: нужные для проверки
+# доступа и для UserSerializer. Счетчики и хеш пароля не кешируются,
+# поэтому save() закешированного объекта их не перезапишет.
+CACHED_USER_FIELDS = (
+    'email', 'username', 'first_name', 'last_name', 'avatar',
+    'avatar_renditions', 'is_active', 'is_staff', 'is_superuser',
+)
+
+
+def token_cache_key(key):
+    return f'auth-token:{key}'
+
+
+def invalidate_token(key):
+    """Удаляет токен из кеша после фиксации транзакции."""
+    transaction.on_commit(lambda: cache.delete(token_cache_key(key)))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication, который хранит токен вместе с пользователем
+    в общем кеше, чтобы не ходить в БД на каждый запрос.
+
+    У пользователя загружаются только CACHED_USER_FIELDS, остальные
+    поля (в том числе хеш пароля) отложены и читаются из БД при
+    обращении. Записи удаляются сигналами при выходе, изменении
+    и удалении пользователя.
+
+    С кешем в памяти процесса сброс из других процессов (воркеров,
+    manage.py) сюда не доходит, поэтому токен проверяется по БД,
+    как в TokenAuthentication.
+    """
+
+    def authenticate_credentials(self, key):
+        if isinstance(caches['default'], LocMemCache):
+            return super().authenticate_credentials(key)
+        cache_key = token_cache_key(key)
+        token = cache.get(cache_key)
+        if token is None:
+            try:
+                token = self.get_model().objects.select_related(
+                    'user'
+                ).only(
+                    'key', 'created', 'user_id',
+                    *(f'user__{field}' for field in CACHED_USER_FIELDS)
+                ).get(key=key)
+            except self.get_model().DoesNotExist:
+                raise exceptions.AuthenticationFailed('Недопустимый токен.')
+            cache.set(cache_key, token, AUTH_TOKEN_CACHE_TIMEOUT)
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                'Пользователь неактивен или удален.'
+            )
+        return token.user, token
@@ -0,0 +1,144 @@
+import hashlib
+import threading
+import time
+from urllib.parse import urlencode
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+from api.constants import MODEL_CACHE_TTL, RESPONSE_CACHE_TIMEOUT
+from recipes.models import Ingredient, Tag
+
+
+def get_version(name):
+    """Возвращает текущую версию группы ключей кеша."""
+    return cache.get_or_set(f'version:{name}', lambda: uuid4().hex, None)
+
+
+def bump_version(name):
+    """
+    Делает недействительными все ключи, построенные на версии name.
+
+    Версия меняется после фиксации транзакции, чтобы параллельный
+    запрос не закешировал под новой версией еще старые данные.
+    """
+    transaction.on_commit(
+        lambda: cache.set(f'version:{name}', uuid4().hex, None)
+    )
+
+
+def user_recipes_version(user_id):
+    """
+    Версия данных, зависящих только от избранного и корзины
+    пользователя, например числа рецептов с фильтром is_in_shopping_cart.
+    """
+    return f'user-recipes:{user_id}'
+
+
+def hash_query_params(query_params, exclude=()):
+    """Хеш параметров запроса, не зависящий от их порядка."""
+    params = urlencode(sorted(
+        (key, value)
+        for key, values in query_params.lists()
+        if key not in exclude
+        for value in values
+    ))
+    return hashlib.md5(params.encode()).hexdigest()
+
+
+def cache_anonymous_response(request, versions, get_response,
+                             validator=None):
+    """
+    Отдает анонимным пользователям сохраненные данные ответа.
+
+    Ключ строится из адреса, параметров запроса, версий versions
+    и validator - того, из чего строится ETag ответа. Смена любой
+    из версий делает запись недействительной, а данные, сохраненные
+    при другом ETag, не отдаются с новым.
+    """
+    if request.user.is_authenticated:
+        return get_response()
+    key = 'response:{}:{}:{}:{}'.format(
+        ':'.join(get_version(name) for name in versions),
+        request.build_absolute_uri(request.path),
+        hash_query_params(request.query_params),
+        hashlib.md5(repr(validator).encode()).hexdigest()
+    )
+    data = cache.get(key)
+    if data is not None:
+        return Response(data)
+    response = get_response()
+    if response.status_code == 200:
+        cache.set(key, response.data, RESPONSE_CACHE_TIMEOUT)
+    return response
+
+
+class ModelInstanceCache:
+    """
+    Все объекты небольшой, редко меняющейся модели в памяти процесса.
+
+    Загружается при первом обращении, сбрасывается сигналами при
+    изменении объектов и перечитывается по истечении ttl, чтобы
+    подхватить изменения из других процессов. Объект, которого
+    еще нет в снимке, ищется в БД.
+    """
+
+    def __init__(self, model, ttl=MODEL_CACHE_TTL):
+        self.model = model
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def __deepcopy__(self, memo):
+        # Поля сериализаторов копируются вместе с аргументами,
+        # а кеш должен оставаться общим.
+        return self
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def _get_snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - snapshot[2] < self.ttl:
+            return snapshot
+        with self._lock:
+            objects = list(self.model.objects.all())
+            snapshot = (
+                objects,
+                {obj.pk: obj for obj in objects},
+                time.monotonic()
+            )
+            self._snapshot = snapshot
+        return snapshot
+
+    def all(self):
+        return self._get_snapshot()[0]
+
+    def get(self, pk):
+        """Возвращает объект по pk или бросает model.DoesNotExist."""
+        obj = self.get_many([int(pk)]).get(int(pk))
+        if obj is None:
+            raise self.model.DoesNotExist
+        return obj
+
+    def get_many(self, pks):
+        """
+        Возвращает словарь {pk: объект} для найденных pk.
+
+        Отсутствующие в снимке pk ищутся в БД одним запросом.
+        """
+        by_pk = self._get_snapshot()[1]
+        found = {pk: by_pk[pk] for pk in pks if pk in by_pk}
+        missing = set(pks) - found.keys()
+        if missing:
+            fetched = self.model.objects.in_bulk(missing)
+            if fetched:
+                self.invalidate()
+            found.update(fetched)
+        return found
+
+
+tag_cache = ModelInstanceCache(Tag)
+ingredient_cache = ModelInstanceCache(Ingredient)
@@ -1,2 +1,48 @@
 PAGE_SIZE = 6
 MAX_PAGE_SIZE = 100
+
+SHOPPING_LIST_TITLE = 'Список покупок:'
+SHOPPING_LIST_DEFAULT_FORMAT = 'txt'
+PDF_FONT_NAME = 'ShoppingListFont'
+PDF_FONT_SIZE = 12
+PDF_TITLE_SIZE = 16
+PDF_LINE_HEIGHT = 18
+PDF_MARGIN = 50
+PDF_SPOOL_SIZE = 1024 * 1024
+PDF_CHUNK_SIZE = 64 * 1024
+
+INGREDIENT_SEARCH_LIMIT = 50
+MODEL_CACHE_TTL = 5 * 60
+FUZZY_SEARCH_PARAM = 'fuzzy'
+
+COUNT_CACHE_TIMEOUT = 60
+APPROXIMATE_COUNT_MIN = 10000
+
+RECIPE_ORDERINGS = {
+    'popular': ('-favorites_count', '-created_at', 'id'),
+    'trending': ('-trending_score', '-created_at', 'id'),
+}
+
+BULK_RECIPES_LIMIT = 100
+
+RESPONSE_CACHE_TIMEOUT = 10 * 60
+AUTH_TOKEN_CACHE_TIMEOUT = 5 * 60
+RECIPES_SHARED_VERSION = 'recipes-shared'
+
+ALLOWED_IMAGE_TYPES = ('png', 'jpeg', 'jpg', 'gif', 'webp')
+MAX_IMAGE_SIZE = 5 * 1024 * 1024
+BASE64_CHUNK_SIZE = 64 * 1024
+MAX_IMAGE_SIDE = 8000
+MAX_IMAGE_PIXELS = 24_000_000
+IMAGE_WORKERS = 2
+IMAGE_RENDITION_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+RECIPE_IMAGE_RENDITIONS = {
+    'card': (600, 400),
+    'detail': (1200, 800),
+}
+AVATAR_RENDITIONS = {
+    'avatar': (160, 160),
+}
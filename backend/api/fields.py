@@ -1,16 +1,189 @@
 import base64
+import binascii
+import re
+from io import BytesIO
 
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import (InMemoryUploadedFile,
+                                            TemporaryUploadedFile)
+from PIL import Image
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
+
+from api.constants import (ALLOWED_IMAGE_TYPES, BASE64_CHUNK_SIZE,
+                           MAX_IMAGE_PIXELS, MAX_IMAGE_SIDE, MAX_IMAGE_SIZE)
+
+DATA_URI_PREFIX = re.compile(r'data:image/([a-z]+);base64,')
 
 
 class Base64ImageField(serializers.ImageField):
+    """
+    Изображение в виде data URI с base64.
+
+    Тип и размер проверяются до декодирования, а размеры в пикселях
+    читаются из заголовка первого декодированного фрагмента. Данные
+    декодируются частями, как загрузка файла: небольшие в память,
+    крупные во временный файл.
+    """
+    default_error_messages = {
+        'too_large': f'Изображение должно быть не больше '
+                     f'{MAX_IMAGE_SIDE}x{MAX_IMAGE_SIDE} и '
+                     f'{MAX_IMAGE_PIXELS} пикселей.',
+        'too_big_file': f'Размер изображения не должен превышать '
+                        f'{MAX_IMAGE_SIZE // (1024 * 1024)} МБ.',
+        'invalid_type': f'Допустимые форматы изображения: '
+                        f'{", ".join(ALLOWED_IMAGE_TYPES)}.',
+    }
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(
-                base64.b64decode(imgstr),
-                name=f'temp.{ext}'
-            )
+            data = self.decode(data)
         return super().to_internal_value(data)
+
+    def decode(self, data):
+        prefix = DATA_URI_PREFIX.match(data)
+        if prefix is None or prefix[1] not in ALLOWED_IMAGE_TYPES:
+            self.fail('invalid_type')
+        start = prefix.end()
+        encoded_length = len(data) - start
+        if encoded_length % 4:
+            self.fail('invalid_image')
+        size = encoded_length // 4 * 3 - len(data) + len(data.rstrip('='))
+        if size > MAX_IMAGE_SIZE:
+            self.fail('too_big_file')
+
+        name = f'temp.{prefix[1]}'
+        content_type = f'image/{prefix[1]}'
+        if size > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            file = TemporaryUploadedFile(name, content_type, size, None)
+        else:
+            file = InMemoryUploadedFile(
+                BytesIO(), None, name, content_type, size, None
+            )
+        try:
+            dimensions_checked = False
+            for offset in range(start, len(data), BASE64_CHUNK_SIZE):
+                file.write(base64.b64decode(
+                    data[offset:offset + BASE64_CHUNK_SIZE], validate=True
+                ))
+                if not dimensions_checked:
+                    dimensions_checked = self.check_dimensions(file)
+            if not dimensions_checked:
+                self.check_dimensions(file)
+        except binascii.Error:
+            file.close()
+            self.fail('invalid_image')
+        except serializers.ValidationError:
+            file.close()
+            raise
+        file.seek(0)
+        return file
+
+    def check_dimensions(self, file):
+        """
+        Отклоняет слишком большие изображения по заголовку.
+
+        Image.open читает только заголовок, пиксели не декодируются.
+        Возвращает False, если заголовок еще не прочитан целиком.
+        """
+        position = file.tell()
+        file.seek(0)
+        try:
+            with Image.open(file) as image:
+                width, height = image.size
+        except Image.DecompressionBombError:
+            self.fail('too_large')
+        except Exception:
+            # Неполный или некорректный файл; во втором случае
+            # его отклонит ImageField.
+            return False
+        finally:
+            file.seek(position)
+        if (max(width, height) > MAX_IMAGE_SIDE
+                or width * height > MAX_IMAGE_PIXELS):
+            self.fail('too_large')
+        return True
+
+
+class ImageRenditionsField(serializers.ReadOnlyField):
+    """Абсолютные ссылки на уменьшенные версии изображения."""
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        renditions = {}
+        for rendition, files in value.get('files', {}).items():
+            renditions[rendition] = {}
+            for extension, name in files.items():
+                url = default_storage.url(name)
+                renditions[rendition][extension] = (
+                    request.build_absolute_uri(url) if request else url
+                )
+        return renditions
+
+
+def to_pk(data):
+    """Приводит значение к целочисленному pk или бросает TypeError."""
+    if isinstance(data, bool):
+        raise TypeError
+    return int(data)
+
+
+class CachedManyRelatedField(serializers.ManyRelatedField):
+    """
+    Список pk, разрешаемый одним обращением к кешу.
+
+    Обо всех несуществующих pk сообщает одной ошибкой.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        return self.child_relation.to_internal_value_many(data)
+
+
+class CachedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField, который берет объекты из кеша процесса."""
+    default_error_messages = {
+        'does_not_exist_many': 'Недопустимые первичные ключи: {pk_values} '
+                               '- объекты не существуют.',
+    }
+
+    def __init__(self, instance_cache=None, **kwargs):
+        self.instance_cache = instance_cache
+        super().__init__(**kwargs)
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return CachedManyRelatedField(**list_kwargs)
+
+    def to_internal_value(self, data):
+        try:
+            return self.instance_cache.get(to_pk(data))
+        except ObjectDoesNotExist:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+    def to_internal_value_many(self, data):
+        pks = []
+        for item in data:
+            try:
+                pks.append(to_pk(item))
+            except (TypeError, ValueError):
+                self.fail('incorrect_type', data_type=type(item).__name__)
+        objects = self.instance_cache.get_many(pks)
+        missing = [pk for pk in dict.fromkeys(pks) if pk not in objects]
+        if missing:
+            self.fail(
+                'does_not_exist_many',
+                pk_values=', '.join(map(str, missing))
+            )
+        return [objects[pk] for pk in pks]
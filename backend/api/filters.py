@@ -1,7 +1,9 @@
 from django_filters import rest_framework as filters_from_django_filters
 from rest_framework import filters
 
-from recipes.models import Recipe, Tag
+from api.cache import tag_cache
+from api.constants import RECIPE_ORDERINGS
+from recipes.models import Recipe
 
 
 class RecipeFilter(filters_from_django_filters.FilterSet):
@@ -11,10 +13,13 @@ class RecipeFilter(filters_from_django_filters.FilterSet):
     is_in_shopping_cart = filters_from_django_filters.BooleanFilter(
         method='filter_in_shopping_cart'
     )
-    tags = filters_from_django_filters.ModelMultipleChoiceFilter(
+    tags = filters_from_django_filters.MultipleChoiceFilter(
         field_name='tags__slug',
-        queryset=Tag.objects.all(),
-        to_field_name='slug'
+        choices=lambda: [(tag.slug, tag.name) for tag in tag_cache.all()]
+    )
+    ordering = filters_from_django_filters.ChoiceFilter(
+        choices=[(name, name) for name in RECIPE_ORDERINGS],
+        method='filter_ordering'
     )
 
     class Meta:
@@ -31,6 +36,9 @@ class RecipeFilter(filters_from_django_filters.FilterSet):
             return queryset.filter(in_shopping_carts__user=self.request.user)
         return queryset
 
+    def filter_ordering(self, queryset, name, value):
+        return queryset.order_by(*RECIPE_ORDERINGS[value])
+
 
 class CustomSearchFilter(filters.SearchFilter):
     search_param = 'name'
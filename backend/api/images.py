@@ -0,0 +1,116 @@
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from api.constants import (AVATAR_RENDITIONS, IMAGE_RENDITION_FORMATS,
+                           IMAGE_WORKERS, RECIPE_IMAGE_RENDITIONS)
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+# Модель -> (поле изображения, поле с версиями, размеры версий).
+IMAGE_PIPELINES = {
+    Recipe._meta.label: ('image', 'image_renditions', RECIPE_IMAGE_RENDITIONS),
+    get_user_model()._meta.label: (
+        'avatar', 'avatar_renditions', AVATAR_RENDITIONS
+    ),
+}
+
+executor = ThreadPoolExecutor(
+    max_workers=IMAGE_WORKERS, thread_name_prefix='images'
+)
+
+
+def needs_processing(instance):
+    image_field, renditions_field, _ = IMAGE_PIPELINES[instance._meta.label]
+    source = getattr(instance, image_field).name or ''
+    return getattr(instance, renditions_field).get('source', '') != source
+
+
+def rendition_name(field_file, rendition, extension):
+    stem = posixpath.splitext(posixpath.basename(field_file.name))[0]
+    return posixpath.join(
+        field_file.field.upload_to, 'renditions',
+        f'{stem}_{rendition}.{extension}'
+    )
+
+
+def render_image(field_file, sizes):
+    """
+    Сохраняет уменьшенные версии изображения во всех форматах.
+
+    Возвращает словарь {версия: {формат: имя файла в хранилище}}.
+    """
+    files = {}
+    with field_file.open('rb'), Image.open(field_file) as image:
+        image = ImageOps.exif_transpose(image)
+        has_alpha = image.mode in ('RGBA', 'LA', 'PA') or (
+            image.mode == 'P' and 'transparency' in image.info
+        )
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+        for rendition, size in sizes.items():
+            resized = image.copy()
+            resized.thumbnail(size, Image.Resampling.LANCZOS)
+            files[rendition] = {}
+            for extension, (image_format, options) in (
+                IMAGE_RENDITION_FORMATS.items()
+            ):
+                output = (
+                    resized.convert('RGB') if image_format == 'JPEG'
+                    else resized
+                )
+                buffer = BytesIO()
+                output.save(buffer, image_format, **options)
+                files[rendition][extension] = field_file.storage.save(
+                    rendition_name(field_file, rendition, extension),
+                    ContentFile(buffer.getvalue())
+                )
+    return files
+
+
+def process_image(model_label, pk):
+    """Строит версии изображения объекта, если оно изменилось."""
+    model = apps.get_model(model_label)
+    image_field, renditions_field, sizes = IMAGE_PIPELINES[model_label]
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or not needs_processing(instance):
+        return
+    field_file = getattr(instance, image_field)
+    renditions = {}
+    if field_file:
+        renditions = {
+            'source': field_file.name,
+            'files': render_image(field_file, sizes),
+        }
+    setattr(instance, renditions_field, renditions)
+    update_fields = [renditions_field]
+    if model is Recipe:
+        update_fields.append('updated_at')
+    instance.save(update_fields=update_fields)
+
+
+def run_in_worker(model_label, pk):
+    close_old_connections()
+    try:
+        process_image(model_label, pk)
+    except Exception:
+        logger.exception(
+            'Не удалось обработать изображение %s %s', model_label, pk
+        )
+    finally:
+        close_old_connections()
+
+
+def schedule_processing(instance):
+    """Ставит обработку изображения в пул после фиксации транзакции."""
+    transaction.on_commit(partial(
+        executor.submit, run_in_worker, instance._meta.label, instance.pk
+    ))
@@ -0,0 +1,11 @@
+from rest_framework.negotiation import DefaultContentNegotiation
+
+
+class IgnoreFormatContentNegotiation(DefaultContentNegotiation):
+    """
+    Не выбирает рендерер по ?format=: в выгрузке списка покупок
+    этот параметр задает формат файла.
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
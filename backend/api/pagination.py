@@ -1,9 +1,181 @@
-from rest_framework.pagination import PageNumberPagination
+from functools import partial
 
-from api.constants import MAX_PAGE_SIZE, PAGE_SIZE
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+from api.cache import get_version, hash_query_params, user_recipes_version
+from api.constants import (APPROXIMATE_COUNT_MIN, COUNT_CACHE_TIMEOUT,
+                           MAX_PAGE_SIZE, PAGE_SIZE, RECIPE_ORDERINGS)
+from recipes.models import Recipe
 
 
 class CustomPageNumberPagination(PageNumberPagination):
     page_size = PAGE_SIZE
     page_size_query_param = 'limit'
     max_page_size = MAX_PAGE_SIZE
+
+
+class LookaheadPage(Page):
+    """Страница, о следующей странице которой известно по выборке."""
+
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Paginator, который не считает COUNT(*) на каждый запрос.
+
+    Для выборки без условий берет оценку планировщика Postgres
+    (pg_class.reltuples), если таблица достаточно большая,
+    в остальных случаях кеширует точное значение по cache_key.
+    Приблизительное число только показывается в ответе: есть ли
+    страница и следующая за ней, решает выборка per_page + 1 строк.
+    """
+
+    def __init__(self, object_list, per_page, cache_key=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.cache_key = cache_key
+
+    def validate_number(self, number):
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(_('That page number is not an integer'))
+        if number < 1:
+            raise EmptyPage(_('That page number is less than 1'))
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        object_list = list(
+            self.object_list[bottom:bottom + self.per_page + 1]
+        )
+        if not object_list and number > 1:
+            raise EmptyPage(_('That page contains no results'))
+        return LookaheadPage(
+            object_list[:self.per_page], number, self,
+            has_next=len(object_list) > self.per_page
+        )
+
+    @cached_property
+    def count(self):
+        count = self.get_estimated_count()
+        if count is not None:
+            return count
+        count = cache.get(self.cache_key)
+        if count is None:
+            count = super().count
+            cache.set(self.cache_key, count, COUNT_CACHE_TIMEOUT)
+        return count
+
+    def get_estimated_count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or queryset.query.where:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class '
+                'WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        if row and row[0] >= APPROXIMATE_COUNT_MIN:
+            return row[0]
+        return None
+
+
+class CachedCountPagination(CustomPageNumberPagination):
+    """
+    Пагинация с кешированным числом объектов.
+
+    Ключ кеша строится из пути, пользователя и параметров фильтрации
+    без номера и размера страницы. Версия модели сбрасывается сигналами
+    при создании и удалении ее объектов, а версия пользователя -
+    при изменении его корзины.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.django_paginator_class = partial(
+            CachedCountPaginator,
+            cache_key=self.get_count_cache_key(queryset, request)
+        )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count_cache_key(self, queryset, request):
+        user = request.user
+        return 'count:{}:{}:{}:{}:{}:{}'.format(
+            queryset.model._meta.label_lower,
+            get_version(queryset.model._meta.label_lower),
+            user.pk,
+            get_version(user_recipes_version(user.pk))
+            if user.is_authenticated else None,
+            request.path,
+            hash_query_params(
+                request.query_params,
+                exclude=(self.page_query_param, self.page_size_query_param)
+            )
+        )
+
+
+class RecipeCursorPagination(CursorPagination):
+    """
+    Курсор по дате создания.
+
+    CursorPagination строит позицию только по первому полю сортировки,
+    а счетчики избранного и trending_score меняются и почти всегда
+    совпадают. Для таких сортировок курсор пропускал бы и повторял
+    рецепты, поэтому они доступны только постранично.
+    """
+    page_size = PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = MAX_PAGE_SIZE
+    ordering = Recipe._meta.ordering + ('id',)
+
+    def get_ordering(self, request, queryset, view):
+        if request.query_params.get('ordering') in RECIPE_ORDERINGS:
+            raise ValidationError({
+                self.cursor_query_param: (
+                    'Курсор доступен только для сортировки по дате, '
+                    'используйте параметр page.'
+                )
+            })
+        return self.ordering
+
+
+class RecipePagination(CachedCountPagination):
+    """
+    Постраничная пагинация ленты рецептов.
+
+    Если передан параметр cursor (для первой страницы - пустой),
+    выдача идет по дате создания без OFFSET и COUNT(*),
+    а ответ содержит только next, previous и results.
+    """
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param in request.query_params:
+            self.cursor_paginator = RecipeCursorPagination()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        self.cursor_paginator = None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,74 @@
+import threading
+from bisect import bisect_left
+
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db.models import BooleanField, ExpressionWrapper, Q
+from django.db.models.functions import Upper
+
+from api.cache import ingredient_cache
+from api.constants import INGREDIENT_SEARCH_LIMIT
+from recipes.models import Ingredient
+
+
+class IngredientPrefixIndex:
+    """
+    Индекс ингредиентов в памяти процесса для автодополнения.
+
+    Хранит ингредиенты из ingredient_cache, отсортированные по названию
+    в нижнем регистре, и отвечает на префиксные запросы двоичным поиском
+    без обращения к БД. Перестраивается, когда меняется снимок кеша.
+    """
+
+    def __init__(self, instance_cache):
+        self.instance_cache = instance_cache
+        self._lock = threading.Lock()
+        self._index = None
+
+    def _get_index(self):
+        source = self.instance_cache.all()
+        index = self._index
+        if index is not None and index[2] is source:
+            return index[0], index[1]
+        with self._lock:
+            ingredients = sorted(
+                source, key=lambda ingredient: ingredient.name.lower()
+            )
+            keys = [ingredient.name.lower() for ingredient in ingredients]
+            self._index = (keys, ingredients, source)
+        return keys, ingredients
+
+    def search(self, prefix, limit=INGREDIENT_SEARCH_LIMIT):
+        prefix = prefix.lower()
+        keys, ingredients = self._get_index()
+        start = end = bisect_left(keys, prefix)
+        while end < len(keys) and keys[end].startswith(prefix):
+            end += 1
+        matches = ingredients[start:end]
+        matches.sort(key=lambda ingredient: (
+            ingredient.name.lower() != prefix, len(ingredient.name)
+        ))
+        return matches[:limit]
+
+
+ingredient_index = IngredientPrefixIndex(ingredient_cache)
+
+
+def fuzzy_search_ingredients(name, limit=INGREDIENT_SEARCH_LIMIT):
+    """
+    Ищет ингредиенты по подстроке и с учетом опечаток.
+
+    Все условия строятся по UPPER(name), чтобы их обслуживал
+    GIN-индекс pg_trgm на этом выражении. Сначала идут совпадения
+    по префиксу, затем самые похожие.
+    """
+    name = name.upper()
+    return Ingredient.objects.annotate(
+        upper_name=Upper('name')
+    ).annotate(
+        is_prefix=ExpressionWrapper(
+            Q(upper_name__startswith=name), output_field=BooleanField()
+        ),
+        similarity=TrigramWordSimilarity(name, 'upper_name'),
+    ).filter(
+        Q(upper_name__contains=name) | Q(upper_name__trigram_word_similar=name)
+    ).order_by('-is_prefix', '-similarity', 'name')[:limit]
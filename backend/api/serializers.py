@@ -1,10 +1,15 @@
 from django.contrib.auth import authenticate, get_user_model
+from django.db import transaction
 from rest_framework import serializers
 
-from api.fields import Base64ImageField
+from api.cache import ingredient_cache, tag_cache
+from api.constants import BULK_RECIPES_LIMIT
+from api.fields import (Base64ImageField, CachedPrimaryKeyRelatedField,
+                        ImageRenditionsField)
+from api.utils import delete_returning
 from recipes.constants import MAX_SMALL_INTEGER, MIN_SMALL_INTEGER
 from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Tag)
+                            ShoppingCart, ShoppingListItem, Tag)
 
 User = get_user_model()
 
@@ -12,19 +17,25 @@ User = get_user_model()
 class UserSerializer(serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
     avatar = Base64ImageField(required=False, allow_null=True)
+    avatar_renditions = ImageRenditionsField()
 
     class Meta:
         model = User
         fields = (
             'email', 'id', 'username',
             'first_name', 'last_name',
-            'is_subscribed', 'avatar'
+            'is_subscribed', 'avatar', 'avatar_renditions'
         )
 
     def get_is_subscribed(self, obj):
         user = self.context.get('request').user
-        return (user.is_authenticated
-                and obj.following.filter(user=user).exists())
+        if not user.is_authenticated:
+            return False
+        if 'subscribed_ids' not in self.context:
+            self.context['subscribed_ids'] = set(
+                user.follower.values_list('author_id', flat=True)
+            )
+        return obj.id in self.context['subscribed_ids']
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -40,10 +51,9 @@ class IngredientSerializer(serializers.ModelSerializer):
 
 
 class RecipeIngredientWriteSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all(),
-        source='ingredient'
-    )
+    # Ингредиенты всего рецепта разрешаются одним запросом
+    # в RecipeCreateUpdateSerializer.validate_ingredients.
+    id = serializers.IntegerField(source='ingredient', min_value=1)
 
     class Meta:
         model = RecipeIngredient
@@ -77,52 +87,39 @@ class RecipeListSerializer(serializers.ModelSerializer):
         many=True,
         source='recipe_ingredients'
     )
-    is_favorited = serializers.SerializerMethodField()
-    is_in_shopping_cart = serializers.SerializerMethodField()
+    is_favorited = serializers.BooleanField(read_only=True, default=False)
+    is_in_shopping_cart = serializers.BooleanField(
+        read_only=True, default=False
+    )
+    image_renditions = ImageRenditionsField()
 
     class Meta:
         model = Recipe
         fields = (
             'id', 'tags', 'author', 'ingredients',
             'is_favorited', 'is_in_shopping_cart',
-            'name', 'image', 'text', 'cooking_time'
+            'name', 'image', 'image_renditions', 'text', 'cooking_time'
         )
 
-    def get_is_favorited(self, obj):
-        user = self.context['request'].user
-        return not user.is_anonymous and Favorite.objects.filter(
-            user=user,
-            recipe=obj
-        ).exists()
-
-    def get_is_in_shopping_cart(self, obj):
-        user = self.context['request'].user
-        return not user.is_anonymous and ShoppingCart.objects.filter(
-            user=user,
-            recipe=obj
-        ).exists()
-
 
 class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
     ingredients = RecipeIngredientWriteSerializer(
         many=True,
         source='recipe_ingredients'
     )
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = CachedPrimaryKeyRelatedField(
         many=True,
+        instance_cache=tag_cache,
         queryset=Tag.objects.all(),
     )
     image = Base64ImageField()
     author = UserSerializer(read_only=True)
-    is_favorited = serializers.SerializerMethodField(read_only=True)
-    is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Recipe
         fields = (
             'ingredients', 'tags', 'image', 'name', 'text',
-            'cooking_time', 'author',
-            'id', 'is_favorited', 'is_in_shopping_cart'
+            'cooking_time', 'author', 'id'
         )
 
     def validate(self, data):
@@ -141,11 +138,19 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 'Рецепт должен содержать хотя бы один ингредиент!'
             )
-        ingredient_ids = [item['ingredient'].id for item in value]
+        ingredient_ids = [item['ingredient'] for item in value]
         if len(ingredient_ids) != len(set(ingredient_ids)):
             raise serializers.ValidationError(
                 {'ingredients': 'Ингредиенты не должны повторяться!'}
             )
+        ingredients = ingredient_cache.get_many(ingredient_ids)
+        missing = [pk for pk in ingredient_ids if pk not in ingredients]
+        if missing:
+            raise serializers.ValidationError(
+                f'Ингредиенты не найдены: {", ".join(map(str, missing))}'
+            )
+        for item in value:
+            item['ingredient'] = ingredients[item['ingredient']]
         return value
 
     def validate_tags(self, value):
@@ -169,54 +174,99 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
             ) for ingredient_data in ingredients
         )
 
+    def update_ingredients(self, recipe, ingredients):
+        """
+        Приводит ингредиенты рецепта к новому списку, меняя только
+        добавленные, удаленные и изменившиеся строки.
+
+        Возвращает прежние количества {ingredient_id: amount}.
+        """
+        existing = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in recipe.recipe_ingredients.all()
+        }
+        old_amounts = {
+            ingredient_id: recipe_ingredient.amount
+            for ingredient_id, recipe_ingredient in existing.items()
+        }
+        new_items = {item['ingredient'].id: item for item in ingredients}
+        removed_ids = existing.keys() - new_items.keys()
+        if removed_ids:
+            # В обход сигналов: списки покупок пересчитывает update().
+            delete_returning(
+                recipe.recipe_ingredients.filter(
+                    ingredient_id__in=removed_ids
+                ),
+                'ingredient_id'
+            )
+        self.create_ingredients(recipe, [
+            item for ingredient_id, item in new_items.items()
+            if ingredient_id not in existing
+        ])
+        changed = []
+        for ingredient_id, item in new_items.items():
+            recipe_ingredient = existing.get(ingredient_id)
+            if (recipe_ingredient is not None
+                    and recipe_ingredient.amount != item['amount']):
+                recipe_ingredient.amount = item['amount']
+                changed.append(recipe_ingredient)
+        RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        return old_amounts
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop('recipe_ingredients')
         tags = validated_data.pop('tags')
-        recipe = Recipe.objects.create(
-            **validated_data,
-            author=self.context['request'].user
-        )
+        author = self.context['request'].user
+        recipe = Recipe.objects.create(**validated_data, author=author)
         recipe.tags.set(tags)
         self.create_ingredients(recipe, ingredients_data)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients_data = validated_data.pop('recipe_ingredients')
         tags = validated_data.pop('tags')
 
-        instance = super().update(instance, validated_data)
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save_without_counters()
 
         if tags is not None:
             instance.tags.set(tags)
 
         if ingredients_data is not None:
-            instance.recipe_ingredients.all().delete()
-            self.create_ingredients(instance, ingredients_data)
+            old_amounts = self.update_ingredients(instance, ingredients_data)
+            amounts = {
+                item['ingredient'].id: item['amount']
+                for item in ingredients_data
+            }
+            ShoppingListItem.objects.apply_amounts(
+                instance.in_shopping_carts.values_list('user_id', flat=True),
+                {
+                    ingredient_id: (
+                        amounts.get(ingredient_id, 0)
+                        - old_amounts.get(ingredient_id, 0)
+                    )
+                    for ingredient_id in amounts.keys() | old_amounts.keys()
+                }
+            )
 
         return instance
 
     def to_representation(self, instance):
+        instance = Recipe.objects.with_user_annotations(
+            self.context['request'].user
+        ).with_related().get(pk=instance.pk)
         return RecipeListSerializer(instance, context=self.context).data
 
-    def get_is_favorited(self, obj):
-        user = self.context['request'].user
-        return not user.is_anonymous and Favorite.objects.filter(
-            user=user,
-            recipe=obj
-        ).exists()
-
-    def get_is_in_shopping_cart(self, obj):
-        user = self.context['request'].user
-        return not user.is_anonymous and ShoppingCart.objects.filter(
-            user=user,
-            recipe=obj
-        ).exists()
-
 
 class RecipeMinifiedSerializer(serializers.ModelSerializer):
+    image_renditions = ImageRenditionsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_renditions', 'cooking_time')
 
 
 class ShoppingCartSerializer(serializers.ModelSerializer):
@@ -243,6 +293,14 @@ class FavoriteSerializer(serializers.ModelSerializer):
         ).data
 
 
+class RecipeIdsSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BULK_RECIPES_LIMIT
+    )
+
+
 class RecipeShortLinkSerializer(serializers.ModelSerializer):
     short_link = serializers.SerializerMethodField(label='short-link')
 
@@ -286,25 +344,23 @@ class SetAvatarSerializer(serializers.ModelSerializer):
         model = User
         fields = ('avatar',)
 
+    def update(self, instance, validated_data):
+        instance.avatar = validated_data['avatar']
+        instance.save(update_fields=('avatar',))
+        return instance
+
 
 class UserWithRecipesSerializer(UserSerializer):
-    recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes = RecipeMinifiedSerializer(
+        many=True,
+        read_only=True,
+        source='recipes_preview'
+    )
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta(UserSerializer.Meta):
         fields = UserSerializer.Meta.fields + ('recipes', 'recipes_count')
 
-    def get_recipes(self, obj):
-        request = self.context.get('request')
-        recipes_limit = request.query_params.get('recipes_limit')
-        queryset = obj.recipes.all()
-        if recipes_limit:
-            queryset = queryset[:int(recipes_limit)]
-        return RecipeMinifiedSerializer(queryset, many=True).data
-
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
 
 class EmailAuthTokenSerializer(serializers.Serializer):
     email = serializers.EmailField(
@@ -0,0 +1,274 @@
+from django.contrib.auth import get_user_model
+from django.db.models import F, QuerySet
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from api.authentication import invalidate_token
+from api.cache import (bump_version, ingredient_cache, tag_cache,
+                       user_recipes_version)
+from api.constants import RECIPES_SHARED_VERSION
+from api.images import needs_processing, schedule_processing
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, ShoppingListItem, Tag)
+from users.models import Subscription
+
+User = get_user_model()
+RECIPES_VERSION = Recipe._meta.label_lower
+USERS_VERSION = User._meta.label_lower
+
+
+def bump_recipe_versions(*recipe_ids):
+    bump_version(RECIPES_VERSION)
+    for recipe_id in recipe_ids:
+        bump_version(f'recipe:{recipe_id}')
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_cache(**kwargs):
+    ingredient_cache.invalidate()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tag_cache(**kwargs):
+    tag_cache.invalidate()
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def invalidate_recipe(instance, **kwargs):
+    bump_recipe_versions(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=User)
+def process_changed_image(instance, **kwargs):
+    if needs_processing(instance):
+        schedule_processing(instance)
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def invalidate_recipe_ingredients(instance, **kwargs):
+    bump_recipe_versions(instance.recipe_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tags(instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        bump_recipe_versions(instance.pk)
+    elif pk_set:
+        bump_recipe_versions(*pk_set)
+    else:
+        bump_version(RECIPES_SHARED_VERSION)
+
+
+@receiver(post_save, sender=Favorite)
+def invalidate_recipe_counts_on_create(created, **kwargs):
+    if created:
+        bump_version(RECIPES_VERSION)
+
+
+@receiver(post_delete, sender=Favorite)
+def invalidate_recipe_counts(**kwargs):
+    bump_version(RECIPES_VERSION)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def invalidate_user_recipes_on_create(instance, created, **kwargs):
+    if created:
+        bump_version(user_recipes_version(instance.user_id))
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def invalidate_user_recipes(instance, **kwargs):
+    bump_version(user_recipes_version(instance.user_id))
+
+
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_recipes_shared(**kwargs):
+    bump_version(RECIPES_SHARED_VERSION)
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_on_save(instance, created, update_fields, **kwargs):
+    if created:
+        bump_version(USERS_VERSION)
+    elif update_fields is None or set(update_fields) != {'last_login'}:
+        bump_version(RECIPES_SHARED_VERSION)
+        Recipe.objects.filter(author=instance).update(
+            updated_at=timezone.now()
+        )
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def touch_tag_recipes(instance, **kwargs):
+    Recipe.objects.filter(tags=instance).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Ingredient)
+def touch_ingredient_recipes(instance, **kwargs):
+    Recipe.objects.filter(ingredients=instance).update(
+        updated_at=timezone.now()
+    )
+
+
+@receiver(post_save, sender=Subscription)
+def invalidate_user_counts_on_create(created, **kwargs):
+    if created:
+        bump_version(USERS_VERSION)
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Subscription)
+def invalidate_user_counts(**kwargs):
+    bump_version(USERS_VERSION)
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(instance, created, **kwargs):
+    if not created:
+        for key in Token.objects.filter(user=instance).values_list(
+            'key', flat=True
+        ):
+            invalidate_token(key)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+def deletion_started_from(model, origin):
+    """Удаление начато с объектов model, а не пришло к ним каскадом."""
+    if isinstance(origin, QuerySet):
+        return origin.model is model
+    return isinstance(origin, model)
+
+
+# Счетчики меняются здесь для изменений через ORM, включая каскадные
+# удаления. Избранное и подписки API создает и удаляет в обход сигналов
+# и обновляет счетчики сам.
+
+def change_counter(queryset, field, delta):
+    queryset.update(**{field: F(field) + delta})
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(instance, created, raw, **kwargs):
+    if created and not raw:
+        change_counter(
+            User.objects.filter(pk=instance.author_id), 'recipes_count', 1
+        )
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(instance, **kwargs):
+    change_counter(
+        User.objects.filter(pk=instance.author_id), 'recipes_count', -1
+    )
+
+
+@receiver(post_save, sender=Favorite)
+def increment_favorites_count(instance, created, raw, **kwargs):
+    if created and not raw:
+        change_counter(
+            Recipe.objects.filter(pk=instance.recipe_id), 'favorites_count', 1
+        )
+
+
+@receiver(post_delete, sender=Favorite)
+def decrement_favorites_count(instance, origin, **kwargs):
+    # Вместе с рецептом удаляется и его счетчик.
+    if not deletion_started_from(Recipe, origin):
+        change_counter(
+            Recipe.objects.filter(pk=instance.recipe_id),
+            'favorites_count', -1
+        )
+
+
+@receiver(post_save, sender=Subscription)
+def increment_subscribers_count(instance, created, raw, **kwargs):
+    if created and not raw:
+        change_counter(
+            User.objects.filter(pk=instance.author_id),
+            'subscribers_count', 1
+        )
+
+
+@receiver(post_delete, sender=Subscription)
+def decrement_subscribers_count(instance, **kwargs):
+    change_counter(
+        User.objects.filter(pk=instance.author_id), 'subscribers_count', -1
+    )
+
+
+# Списки покупок поддерживаются здесь для изменений через ORM (админка,
+# shell). API меняет корзины и ингредиенты рецептов в обход сигналов
+# и пересчитывает списки сам.
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(instance, created, raw, **kwargs):
+    if created and not raw:
+        ShoppingListItem.objects.apply_recipes(
+            (instance.user_id,), (instance.recipe_id,)
+        )
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def remove_from_shopping_list(instance, origin, **kwargs):
+    # При удалении рецепта списки пересчитывает pre_delete рецепта,
+    # при удалении пользователя его список удаляется каскадом.
+    if deletion_started_from(ShoppingCart, origin):
+        ShoppingListItem.objects.apply_recipes(
+            (instance.user_id,), (instance.recipe_id,), sign=-1
+        )
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_shopping_lists(instance, **kwargs):
+    ShoppingListItem.objects.remove_recipe(
+        instance.in_shopping_carts.values_list('user_id', flat=True),
+        instance
+    )
+
+
+@receiver(pre_save, sender=RecipeIngredient)
+def remember_recipe_ingredient(instance, raw, **kwargs):
+    instance._previous_amount = None
+    if instance.pk and not raw:
+        instance._previous_amount = RecipeIngredient.objects.filter(
+            pk=instance.pk
+        ).values_list('ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def update_shopping_lists_on_save(instance, raw, **kwargs):
+    if raw:
+        return
+    amounts = {instance.ingredient_id: instance.amount}
+    if instance._previous_amount:
+        ingredient_id, amount = instance._previous_amount
+        amounts[ingredient_id] = amounts.get(ingredient_id, 0) - amount
+    ShoppingListItem.objects.apply_amounts(
+        ShoppingCart.objects.filter(
+            recipe_id=instance.recipe_id
+        ).values_list('user_id', flat=True),
+        amounts
+    )
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def update_shopping_lists_on_delete(instance, origin, **kwargs):
+    if deletion_started_from(RecipeIngredient, origin):
+        ShoppingListItem.objects.apply_amounts(
+            ShoppingCart.objects.filter(
+                recipe_id=instance.recipe_id
+            ).values_list('user_id', flat=True),
+            {instance.ingredient_id: -instance.amount}
+        )
@@ -0,0 +1,52 @@
+import hashlib
+import os
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Файловое хранилище, называющее файлы по SHA-256 содержимого.
+
+    Одинаковые файлы хранятся один раз, а содержимое по одному адресу
+    никогда не меняется, поэтому /media/ можно кешировать навсегда.
+    Каталог и расширение берутся из исходного имени:
+    recipes/images/temp.png -> recipes/images/ab/ab12...ef.png.
+
+    Один файл может принадлежать нескольким объектам, поэтому delete()
+    ничего не удаляет: неиспользуемые файлы убирает команда
+    collect_media_garbage через purge().
+    """
+
+    def hashed_name(self, name, content):
+        sha256 = hashlib.sha256()
+        for chunk in content.chunks():
+            sha256.update(chunk)
+        content.seek(0)
+        digest = sha256.hexdigest()
+        directory, filename = posixpath.split(name.replace('\\', '/'))
+        extension = posixpath.splitext(filename)[1].lower()
+        return posixpath.join(directory, digest[:2], digest + extension)
+
+    def _save(self, name, content):
+        name = self.hashed_name(name, content)
+        try:
+            # Обновляем mtime, чтобы сборщик мусора не удалил файл,
+            # который только что снова стал использоваться.
+            os.utime(self.path(name))
+            return name
+        except FileNotFoundError:
+            pass
+        if hasattr(content, 'temporary_file_path'):
+            # Копируем, а не переносим: временный файл удалит его владелец.
+            content = File(content.file, content.name)
+        return super()._save(name, content)
+
+    def delete(self, name):
+        pass
+
+    def purge(self, name):
+        """Удаляет файл на самом деле."""
+        super().delete(name)
@@ -1,19 +1,205 @@
-import io
+import csv
+import hashlib
+import tempfile
 
-from django.http import HttpResponse
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import EmptyResultSet
+from django.db import connections, router
+from django.db.models import Count, Max, OuterRef, Prefetch, Subquery
+from django.http import StreamingHttpResponse
+from django.utils.cache import (get_conditional_response, patch_vary_headers,
+                                quote_etag)
+from django.utils.http import http_date
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
 
+from api.constants import (PDF_CHUNK_SIZE, PDF_FONT_NAME, PDF_FONT_SIZE,
+                           PDF_LINE_HEIGHT, PDF_MARGIN, PDF_SPOOL_SIZE,
+                           PDF_TITLE_SIZE, SHOPPING_LIST_TITLE)
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import Subscription
 
-def generate_shopping_list(ingredients):
-    text_buffer = io.StringIO()
-    text_buffer.write('Список покупок:\n\n')
-    for item in ingredients:
-        text_buffer.write(f'{item[0]} - {item[1]} {item[2]}\n')
+User = get_user_model()
 
-    response = HttpResponse(
-        text_buffer.getvalue(),
-        content_type='text/plain'
+
+def with_recipes_preview(authors, recipes_limit=None):
+    """
+    Подгружает первые recipes_limit рецептов
+    каждого автора одним запросом.
+    """
+    recipes = Recipe.objects.all()
+    if recipes_limit and recipes_limit.isdigit():
+        recipes = recipes[:int(recipes_limit)]
+    return authors.prefetch_related(
+        Prefetch('recipes', queryset=recipes, to_attr='recipes_preview')
+    )
+
+
+class Echo:
+    """Псевдобуфер, возвращающий записанную строку вместо хранения."""
+
+    def write(self, value):
+        return value
+
+
+def shopping_list_txt(ingredients):
+    yield f'{SHOPPING_LIST_TITLE}\n\n'
+    for name, amount, unit in ingredients:
+        yield f'{name} - {amount} {unit}\n'
+
+
+def shopping_list_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Количество', 'Единица измерения'))
+    for row in ingredients:
+        yield writer.writerow(row)
+
+
+def shopping_list_pdf(ingredients):
+    pdfmetrics.registerFont(
+        TTFont(PDF_FONT_NAME, settings.SHOPPING_LIST_PDF_FONT)
+    )
+    with tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_SIZE) as buffer:
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        width, height = A4
+        y = height - PDF_MARGIN
+        pdf.setFont(PDF_FONT_NAME, PDF_TITLE_SIZE)
+        pdf.drawString(PDF_MARGIN, y, SHOPPING_LIST_TITLE)
+        pdf.setFont(PDF_FONT_NAME, PDF_FONT_SIZE)
+        y -= PDF_LINE_HEIGHT * 2
+        for name, amount, unit in ingredients:
+            if y < PDF_MARGIN:
+                pdf.showPage()
+                pdf.setFont(PDF_FONT_NAME, PDF_FONT_SIZE)
+                y = height - PDF_MARGIN
+            pdf.drawString(PDF_MARGIN, y, f'{name} - {amount} {unit}')
+            y -= PDF_LINE_HEIGHT
+        pdf.save()
+        buffer.seek(0)
+        yield from iter(lambda: buffer.read(PDF_CHUNK_SIZE), b'')
+
+
+SHOPPING_LIST_FORMATS = {
+    'txt': (shopping_list_txt, 'text/plain; charset=utf-8'),
+    'csv': (shopping_list_csv, 'text/csv; charset=utf-8'),
+    'pdf': (shopping_list_pdf, 'application/pdf'),
+}
+
+
+def generate_shopping_list(ingredients, file_format='txt'):
+    generator, content_type = SHOPPING_LIST_FORMATS[file_format]
+    response = StreamingHttpResponse(
+        generator(ingredients),
+        content_type=content_type
     )
     response['Content-Disposition'] = (
-        'attachment; filename=shopping_list.txt'
+        f'attachment; filename=shopping_list.{file_format}'
     )
     return response
+
+
+def get_user_state(user):
+    """
+    Снимок избранного, корзины и подписок пользователя для ETag.
+
+    Число записей и наибольший id меняются при любом добавлении
+    или удалении, поэтому снимка достаточно, чтобы понять,
+    изменились ли пользовательские флаги в ответе.
+    """
+    if not user.is_authenticated:
+        return None
+    subqueries = []
+    for model in (Favorite, ShoppingCart, Subscription):
+        rows = model.objects.filter(
+            user=OuterRef('pk')
+        ).order_by().values('user')
+        subqueries += (
+            Subquery(rows.annotate(total=Count('pk')).values('total')),
+            Subquery(rows.annotate(last=Max('pk')).values('last')),
+        )
+    return User.objects.filter(pk=user.pk).values_list(
+        *subqueries
+    ).first()
+
+
+def conditional_response(request, etag_parts, last_modified, get_response):
+    """
+    Отвечает 304, если у клиента актуальная версия ресурса,
+    иначе строит ответ через get_response и добавляет к нему
+    ETag и Last-Modified.
+    """
+    etag = quote_etag(
+        hashlib.md5(repr(etag_parts).encode()).hexdigest()
+    )
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(
+        request, etag=etag, last_modified=timestamp
+    )
+    if response is None:
+        response = get_response()
+        if response.status_code == 200:
+            response['ETag'] = etag
+            if timestamp:
+                response['Last-Modified'] = http_date(timestamp)
+    patch_vary_headers(response, ('Authorization',))
+    return response
+
+
+def insert_returning(model, objs, returning):
+    """
+    Вставляет объекты одним INSERT ... ON CONFLICT DO NOTHING RETURNING.
+
+    Возвращает значения поля returning только для действительно
+    вставленных строк: конфликт с уникальным ограничением не ошибка,
+    а пропущенная строка. Сигналы post_save не отправляются.
+    """
+    if not objs:
+        return []
+    connection = connections[router.db_for_write(model)]
+    quote_name = connection.ops.quote_name
+    opts = model._meta
+    fields = [field for field in opts.concrete_fields if not field.primary_key]
+    row_sql = f'({", ".join(["%s"] * len(fields))})'
+    sql = (
+        f'INSERT INTO {quote_name(opts.db_table)} '
+        f'({", ".join(quote_name(field.column) for field in fields)}) '
+        f'VALUES {", ".join([row_sql] * len(objs))} '
+        f'ON CONFLICT DO NOTHING '
+        f'RETURNING {quote_name(opts.get_field(returning).column)}'
+    )
+    params = [
+        field.get_db_prep_save(field.pre_save(obj, True), connection)
+        for obj in objs
+        for field in fields
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def delete_returning(queryset, returning):
+    """
+    Удаляет строки queryset одним DELETE ... RETURNING.
+
+    Возвращает значения поля returning удаленных строк. queryset должен
+    фильтровать только по полям своей таблицы; каскады и сигналы
+    post_delete не выполняются.
+    """
+    model = queryset.model
+    connection = connections[queryset.db]
+    quote_name = connection.ops.quote_name
+    compiler = queryset.query.get_compiler(connection=connection)
+    try:
+        where, params = compiler.compile(queryset.query.where)
+    except EmptyResultSet:
+        return []
+    sql = (
+        f'DELETE FROM {quote_name(model._meta.db_table)} WHERE {where} '
+        f'RETURNING {quote_name(model._meta.get_field(returning).column)}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
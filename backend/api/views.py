@@ -1,6 +1,11 @@
+from functools import partial
+
 from django.contrib.auth import get_user_model
 from django.contrib.auth.hashers import check_password
-from django.db.models import Sum
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Exists, F, Max, OuterRef
+from django.http import Http404
 from django.shortcuts import get_object_or_404, redirect
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import mixins, status, viewsets
@@ -9,46 +14,144 @@ from rest_framework.decorators import action
 from rest_framework.permissions import (AllowAny, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
+from rest_framework.serializers import BooleanField
 
+from api.cache import (bump_version, cache_anonymous_response,
+                       get_version, ingredient_cache, tag_cache,
+                       user_recipes_version)
+from api.constants import (FUZZY_SEARCH_PARAM, RECIPES_SHARED_VERSION,
+                           SHOPPING_LIST_DEFAULT_FORMAT)
 from api.filters import CustomSearchFilter, RecipeFilter
-from api.pagination import CustomPageNumberPagination
+from api.negotiation import IgnoreFormatContentNegotiation
+from api.pagination import CachedCountPagination, RecipePagination
 from api.permissions import IsAuthorOrReadOnly
+from api.search import fuzzy_search_ingredients, ingredient_index
 from api.serializers import (CustomUserCreateSerializer,
                              EmailAuthTokenSerializer, IngredientSerializer,
-                             RecipeCreateUpdateSerializer,
+                             RecipeCreateUpdateSerializer, RecipeIdsSerializer,
                              RecipeListSerializer, RecipeMinifiedSerializer,
                              RecipeShortLinkSerializer, SetAvatarSerializer,
                              TagSerializer, UserSerializer,
                              UserWithRecipesSerializer)
-from api.utils import generate_shopping_list
-from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from api.utils import (SHOPPING_LIST_FORMATS, conditional_response,
+                       delete_returning, generate_shopping_list,
+                       get_user_state, insert_returning,
+                       with_recipes_preview)
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCart,
+                            ShoppingListItem, Tag)
 from users.models import Subscription
 
 User = get_user_model()
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class CachedInstancesMixin:
+    """Отдает список и объекты read-only вьюсета из кеша процесса."""
+    instance_cache = None
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_serializer(self.instance_cache.all(), many=True)
+        return Response(serializer.data)
+
+    def get_object(self):
+        try:
+            return self.instance_cache.get(self.kwargs[self.lookup_field])
+        except (ObjectDoesNotExist, TypeError, ValueError):
+            raise Http404
+
+
+class TagViewSet(CachedInstancesMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
+    instance_cache = tag_cache
     serializer_class = TagSerializer
     pagination_class = None
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(CachedInstancesMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
+    instance_cache = ingredient_cache
     serializer_class = IngredientSerializer
     pagination_class = None
     filter_backends = (CustomSearchFilter,)
     search_fields = ('^name',)
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get(CustomSearchFilter.search_param)
+        if not name:
+            return super().list(request, *args, **kwargs)
+        if (request.query_params.get(FUZZY_SEARCH_PARAM)
+                in BooleanField.TRUE_VALUES):
+            ingredients = fuzzy_search_ingredients(name)
+        else:
+            ingredients = ingredient_index.search(name)
+        serializer = self.get_serializer(ingredients, many=True)
+        return Response(serializer.data)
+
 
 class RecipeViewSet(viewsets.ModelViewSet):
-    queryset = Recipe.objects.select_related(
-        'author'
-    ).prefetch_related('tags', 'ingredients').all()
+    queryset = Recipe.objects.with_related()
     permission_classes = (IsAuthorOrReadOnly, IsAuthenticatedOrReadOnly)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
-    pagination_class = CustomPageNumberPagination
+    pagination_class = RecipePagination
+
+    def get_queryset(self):
+        return super().get_queryset().with_user_annotations(
+            self.request.user
+        )
+
+    def list(self, request, *args, **kwargs):
+        versions = (Recipe._meta.label_lower, RECIPES_SHARED_VERSION)
+        # Удаления, избранное и trending_score не меняют MAX(updated_at),
+        # зато меняют версию рецептов. По той же причине Last-Modified
+        # у списка не отдаем.
+        etag_parts = (
+            request.get_full_path(),
+            self.filter_queryset(Recipe.objects.all()).aggregate(
+                last_modified=Max('updated_at')
+            )['last_modified'],
+            tuple(get_version(name) for name in versions),
+            get_user_state(request.user),
+        )
+        return conditional_response(
+            request,
+            etag_parts,
+            None,
+            partial(
+                cache_anonymous_response,
+                request,
+                versions,
+                partial(super().list, request, *args, **kwargs),
+                validator=etag_parts
+            )
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            state = Recipe.objects.with_user_annotations(
+                request.user
+            ).annotate(
+                is_author_subscribed=Exists(Subscription.objects.filter(
+                    user=request.user.pk, author=OuterRef('author')
+                ))
+            ).values(
+                'updated_at', 'is_favorited', 'is_in_shopping_cart',
+                'is_author_subscribed'
+            ).get(pk=kwargs['pk'])
+        except (Recipe.DoesNotExist, TypeError, ValueError):
+            raise Http404
+        etag_parts = (request.get_full_path(), tuple(state.values()))
+        return conditional_response(
+            request,
+            etag_parts,
+            None if request.user.is_authenticated else state['updated_at'],
+            partial(
+                cache_anonymous_response,
+                request,
+                (f'recipe:{kwargs["pk"]}', RECIPES_SHARED_VERSION),
+                partial(super().retrieve, request, *args, **kwargs),
+                validator=etag_parts
+            )
+        )
 
     def get_serializer_class(self):
         if self.action in ('list', 'retrieve'):
@@ -97,41 +200,174 @@ class RecipeViewSet(viewsets.ModelViewSet):
         recipe = self.get_object()
         return self._remove_from(ShoppingCart, request.user, recipe)
 
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='favorite/bulk',
+        url_name='favorite-bulk',
+        permission_classes=(IsAuthenticated,)
+    )
+    def favorite_bulk(self, request):
+        return self._bulk_change(Favorite, request)
+
+    @action(
+        detail=False,
+        methods=['delete'],
+        url_path='favorite/clear',
+        url_name='favorite-clear',
+        permission_classes=(IsAuthenticated,)
+    )
+    def favorite_clear(self, request):
+        return self._clear(Favorite, request.user)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='shopping_cart/bulk',
+        url_name='shopping-cart-bulk',
+        permission_classes=(IsAuthenticated,)
+    )
+    def shopping_cart_bulk(self, request):
+        return self._bulk_change(ShoppingCart, request)
+
+    @action(
+        detail=False,
+        methods=['delete'],
+        url_path='shopping_cart/clear',
+        url_name='shopping-cart-clear',
+        permission_classes=(IsAuthenticated,)
+    )
+    def shopping_cart_clear(self, request):
+        return self._clear(ShoppingCart, request.user)
+
+    def _bulk_change(self, model, request):
+        """
+        Добавляет (POST) или удаляет (DELETE) список рецептов
+        и возвращает результат по каждому id.
+        """
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = list(dict.fromkeys(serializer.validated_data['recipes']))
+        with transaction.atomic():
+            found_ids = set(Recipe.objects.filter(
+                pk__in=recipe_ids
+            ).values_list('pk', flat=True))
+            if request.method == 'POST':
+                changed_ids = set(insert_returning(
+                    model,
+                    [
+                        model(user=request.user, recipe_id=recipe_id)
+                        for recipe_id in found_ids
+                    ],
+                    'recipe_id'
+                ))
+                changed_status, skipped_status = 'added', 'already_added'
+            else:
+                changed_ids = set(delete_returning(
+                    model.objects.filter(
+                        user=request.user, recipe_id__in=found_ids
+                    ),
+                    'recipe_id'
+                ))
+                changed_status, skipped_status = 'removed', 'not_added'
+            self._sync_recipes(model, request.user, changed_ids, sign=(
+                1 if request.method == 'POST' else -1
+            ))
+        results = []
+        for recipe_id in recipe_ids:
+            if recipe_id not in found_ids:
+                recipe_status = 'not_found'
+            elif recipe_id in changed_ids:
+                recipe_status = changed_status
+            else:
+                recipe_status = skipped_status
+            results.append({'id': recipe_id, 'status': recipe_status})
+        return Response({'results': results})
+
+    @transaction.atomic
+    def _clear(self, model, user):
+        recipe_ids = delete_returning(
+            model.objects.filter(user=user), 'recipe_id'
+        )
+        if model is ShoppingCart:
+            ShoppingListItem.objects.filter(user=user).delete()
+            bump_version(user_recipes_version(user.pk))
+        else:
+            self._sync_recipes(model, user, recipe_ids, sign=-1)
+        return Response({'results': [
+            {'id': recipe_id, 'status': 'removed'}
+            for recipe_id in sorted(recipe_ids)
+        ]})
+
+    def _sync_recipes(self, model, user, recipe_ids, sign):
+        """
+        Обновляет счетчики и списки покупок после добавления (sign=1)
+        или удаления (sign=-1) рецептов.
+        """
+        if not recipe_ids:
+            return
+        # Вставка и удаление идут в обход ORM и сигналов.
+        if model is Favorite:
+            Recipe.objects.filter(pk__in=recipe_ids).update(
+                favorites_count=F('favorites_count') + sign
+            )
+            # Счетчик избранного виден всем через сортировку popular.
+            bump_version(Recipe._meta.label_lower)
+        if model is ShoppingCart:
+            ShoppingListItem.objects.apply_recipes(
+                (user.id,), recipe_ids, sign
+            )
+            bump_version(user_recipes_version(user.pk))
+
+    @transaction.atomic
     def _add_to(self, model, user, recipe):
-        if model.objects.filter(user=user, recipe=recipe).exists():
+        if not insert_returning(
+            model, [model(user=user, recipe=recipe)], 'recipe_id'
+        ):
             return Response(
                 {'errors': 'Рецепт уже добавлен'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        model.objects.create(user=user, recipe=recipe)
+        self._sync_recipes(model, user, (recipe.pk,), sign=1)
         serializer = RecipeMinifiedSerializer(recipe)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @transaction.atomic
     def _remove_from(self, model, user, recipe):
-        deleted, _ = model.objects.filter(user=user, recipe=recipe).delete()
-        if not deleted:
+        if not delete_returning(
+            model.objects.filter(user=user, recipe=recipe), 'recipe_id'
+        ):
             return Response(
                 {'errors': 'Рецепт не был добавлен ранее'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        self._sync_recipes(model, user, (recipe.pk,), sign=-1)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
         detail=False,
         methods=['get'],
-        permission_classes=(IsAuthenticated,)
+        permission_classes=(IsAuthenticated,),
+        content_negotiation_class=IgnoreFormatContentNegotiation
     )
     def download_shopping_cart(self, request):
-        ingredients = Ingredient.objects.filter(
-            recipeingredient__recipe__in_shopping_carts__user=request.user
-        ).annotate(
-            total_amount=Sum('recipeingredient__amount')
-        ).values_list(
-            'name',
-            'total_amount',
-            'measurement_unit'
+        file_format = request.query_params.get(
+            'format', SHOPPING_LIST_DEFAULT_FORMAT
         )
-        return generate_shopping_list(ingredients)
+        if file_format not in SHOPPING_LIST_FORMATS:
+            return Response(
+                {'errors': 'Доступные форматы: '
+                 f'{", ".join(SHOPPING_LIST_FORMATS)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        ingredients = ShoppingListItem.objects.filter(
+            user=request.user
+        ).values_list(
+            'ingredient__name',
+            'amount',
+            'ingredient__measurement_unit'
+        ).order_by('ingredient__name')
+        return generate_shopping_list(ingredients.iterator(), file_format)
 
 
 def redirect_short_link(request, pk):
@@ -146,6 +382,7 @@ class SubscriptionViewSet(
 ):
     permission_classes = (IsAuthenticated,)
 
+    @transaction.atomic
     def create(self, request, *args, **kwargs):
         author_id = self.kwargs.get('id')
         author = self.get_object(author_id)
@@ -155,35 +392,47 @@ class SubscriptionViewSet(
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        if Subscription.objects.filter(
-            user=request.user, author=author
-        ).exists():
+        if not insert_returning(
+            Subscription,
+            [Subscription(user=request.user, author=author)],
+            'author_id'
+        ):
             return Response(
                 {'detail': 'Вы уже подписаны на этого пользователя'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        Subscription.objects.create(user=request.user, author=author)
+        User.objects.filter(pk=author.pk).update(
+            subscribers_count=F('subscribers_count') + 1
+        )
+        bump_version(User._meta.label_lower)
+        author = with_recipes_preview(
+            User.objects.filter(pk=author.pk),
+            request.query_params.get('recipes_limit')
+        ).get()
         serializer = UserWithRecipesSerializer(
             author, context={'request': request}
         )
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @transaction.atomic
     def destroy(self, request, *args, **kwargs):
         author_id = self.kwargs.get('id')
         author = get_object_or_404(User, id=author_id)
-        subscription = Subscription.objects.filter(
-            user=request.user,
-            author=author
-        )
 
-        if not subscription.exists():
+        if not delete_returning(
+            Subscription.objects.filter(user=request.user, author=author),
+            'author_id'
+        ):
             return Response(
                 {'detail': 'Вы не подписаны на этого пользователя'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        subscription.delete()
+        User.objects.filter(pk=author.pk).update(
+            subscribers_count=F('subscribers_count') - 1
+        )
+        bump_version(User._meta.label_lower)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     def get_object(self, user_id):
@@ -213,7 +462,7 @@ class CustomTokenViewSet(viewsets.ViewSet):
 class CustomUserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
-    pagination_class = CustomPageNumberPagination
+    pagination_class = CachedCountPagination
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -259,9 +508,10 @@ class CustomUserViewSet(viewsets.ModelViewSet):
             )
         user = request.user
         if user.avatar:
-            user.avatar.delete()
+            # Файл может использоваться другими пользователями,
+            # его удалит collect_media_garbage.
             user.avatar = None
-            user.save()
+            user.save(update_fields=('avatar',))
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -270,9 +520,10 @@ class CustomUserViewSet(viewsets.ModelViewSet):
         permission_classes=(IsAuthenticated,)
     )
     def subscriptions(self, request):
-        authors = User.objects.filter(
-            following__user=request.user
-        )
+        authors = with_recipes_preview(
+            User.objects.filter(following__user=request.user),
+            request.query_params.get('recipes_limit')
+        ).order_by('following__created')
 
         page = self.paginate_queryset(authors)
         if page is not None:
@@ -299,7 +550,7 @@ class CustomUserViewSet(viewsets.ModelViewSet):
         user = request.user
         if check_password(request.data['current_password'], user.password):
             user.set_password(request.data['new_password'])
-            user.save()
+            user.save(update_fields=('password',))
             return Response(status=status.HTTP_204_NO_CONTENT)
         else:
             return Response(
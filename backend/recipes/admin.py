@@ -25,14 +25,16 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('tags', 'author')
     readonly_fields = ('favorites_count',)
 
+    def save_model(self, request, obj, form, change):
+        if change:
+            obj.save_without_counters()
+        else:
+            obj.save()
+
     @admin.display(description='Время приготовления (мин)')
     def display_cooking_time(self, obj):
         return obj.cooking_time
 
-    @admin.display(description='Добавлений в избранное')
-    def favorites_count(self, obj):
-        return obj.favorites_count
-
     @admin.display(description='Теги')
     @mark_safe
     def display_tags(self, obj):
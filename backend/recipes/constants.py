@@ -3,3 +3,6 @@ MEASURMENT_NAME_LIMIT = 64
 BIGGER_NAME_LIMIT = 256
 MIN_SMALL_INTEGER = 1
 MAX_SMALL_INTEGER = 32767
+TRENDING_GRAVITY = 1.8
+TRENDING_AGE_OFFSET_HOURS = 2
+TRENDING_BATCH_SIZE = 1000
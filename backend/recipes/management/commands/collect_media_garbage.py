@@ -0,0 +1,77 @@
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.images import IMAGE_PIPELINES
+
+MIN_AGE_HOURS = 24
+
+
+def walk(storage, path):
+    directories, files = storage.listdir(path)
+    for filename in files:
+        yield f'{path}{filename}'
+    for directory in directories:
+        yield from walk(storage, f'{path}{directory}/')
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет из хранилища изображения, на которые не ссылается '
+        'ни один рецепт или пользователь'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=MIN_AGE_HOURS,
+            help='Не трогать файлы моложе указанного числа часов'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только вывести файлы, которые будут удалены'
+        )
+
+    def get_referenced(self):
+        referenced = set()
+        directories = set()
+        for model_label, (image_field, renditions_field, _) in (
+            IMAGE_PIPELINES.items()
+        ):
+            model = apps.get_model(model_label)
+            directories.add(model._meta.get_field(image_field).upload_to)
+            rows = model.objects.values_list(
+                image_field, renditions_field
+            ).iterator()
+            for name, renditions in rows:
+                if name:
+                    referenced.add(name)
+                for files in renditions.get('files', {}).values():
+                    referenced.update(files.values())
+        return referenced, directories
+
+    def handle(self, *args, **options):
+        storage = default_storage
+        referenced, directories = self.get_referenced()
+        modified_before = timezone.now() - timedelta(hours=options['min_age'])
+        deleted_count = 0
+        for directory in sorted(directories):
+            if not storage.exists(directory):
+                continue
+            for name in walk(storage, directory):
+                if (name in referenced
+                        or storage.get_modified_time(name) > modified_before):
+                    continue
+                if options['dry_run']:
+                    self.stdout.write(name)
+                else:
+                    getattr(storage, 'purge', storage.delete)(name)
+                deleted_count += 1
+        self.stdout.write(
+            self.style.SUCCESS(f'Неиспользуемых файлов: {deleted_count}')
+        )
@@ -1,46 +1,130 @@
+import csv
 import json
+import time
+from itertools import islice
+from pathlib import Path
 
 from django.core.management.base import BaseCommand
+from django.db import transaction
 
 from recipes.models import Ingredient
 
+BATCH_SIZE = 1000
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+def iter_json_array(file, chunk_size=JSON_CHUNK_SIZE):
+    """Построчно разбирает JSON-массив, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise json.JSONDecodeError('Ожидался JSON-массив', buffer, 0)
+    buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip()
+        if buffer.startswith(','):
+            buffer = buffer[1:].lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                raise
+            buffer += chunk
+            continue
+        if not isinstance(item, dict):
+            raise json.JSONDecodeError('Ожидался JSON-объект', buffer, 0)
+        yield item['name'], item['measurement_unit']
+        buffer = buffer[end:]
+
+
+def iter_csv_rows(file):
+    for row in csv.reader(file):
+        if row:
+            name, measurement_unit = row
+            yield name, measurement_unit
+
+
+READERS = {
+    'json': iter_json_array,
+    'csv': iter_csv_rows,
+}
+
 
 class Command(BaseCommand):
-    help = 'Загружает ингредиенты из JSON-файла в базу данных'
+    help = 'Загружает ингредиенты из JSON- или CSV-файла в базу данных'
 
     def add_arguments(self, parser):
         parser.add_argument(
-            'json_file',
+            'file_path',
             type=str,
-            help='Путь к JSON-файлу с ингредиентами'
+            help='Путь к JSON- или CSV-файлу с ингредиентами'
+        )
+        parser.add_argument(
+            '--format',
+            choices=READERS,
+            help='Формат файла; по умолчанию определяется по расширению'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Количество ингредиентов в одном INSERT'
         )
 
     def handle(self, *args, **options):
-        file_path = options['json_file']
+        file_path = options['file_path']
+        file_format = options['format'] or Path(file_path).suffix[1:].lower()
+        if file_format not in READERS:
+            self.stderr.write(
+                f'Ошибка: Неизвестный формат файла {file_path}'
+            )
+            return
 
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                ingredients_data = json.load(file)
-
-                created_count = 0
-                for item in ingredients_data:
-                    obj, created = Ingredient.objects.get_or_create(
-                        name=item['name'],
-                        defaults={'measurement_unit': item['measurement_unit']}
-                    )
-                    if created:
-                        created_count += 1
-
-                self.stdout.write(
-                    self.style.SUCCESS(
-                        f'Успешно загружено {created_count}'
-                        '/{len(ingredients_data)} ингредиентов'
-                    )
+            with open(file_path, 'r', encoding='utf-8', newline='') as file:
+                started = time.monotonic()
+                total_count, created_count = self.load(
+                    READERS[file_format](file), options['batch_size']
                 )
-
+                elapsed = time.monotonic() - started
         except FileNotFoundError:
             self.stderr.write(f'Ошибка: Файл {file_path} не найден')
+            return
         except json.JSONDecodeError:
             self.stderr.write('Ошибка: Некорректный JSON-формат')
+            return
+        except ValueError:
+            self.stderr.write('Ошибка: Некорректная строка CSV')
+            return
         except KeyError as e:
             self.stderr.write(f'Ошибка: Отсутствует обязательное поле {e}')
+            return
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Успешно загружено {created_count}/{total_count} '
+                f'ингредиентов за {elapsed:.2f} с '
+                f'({total_count / max(elapsed, 1e-6):.0f} строк/с)'
+            )
+        )
+
+    @transaction.atomic
+    def load(self, rows, batch_size):
+        count_before = Ingredient.objects.count()
+        total_count = 0
+        while batch := list(islice(rows, batch_size)):
+            # Уникальный ключ - оба поля ингредиента, обновлять при
+            # конфликте нечего, поэтому вместо update_conflicts
+            # достаточно ON CONFLICT DO NOTHING.
+            Ingredient.objects.bulk_create(
+                (
+                    Ingredient(name=name, measurement_unit=measurement_unit)
+                    for name, measurement_unit in batch
+                ),
+                ignore_conflicts=True
+            )
+            total_count += len(batch)
+        return total_count, Ingredient.objects.count() - count_before
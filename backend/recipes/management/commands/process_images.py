@@ -0,0 +1,27 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from api.images import IMAGE_PIPELINES, needs_processing, process_image
+
+
+class Command(BaseCommand):
+    help = (
+        'Строит уменьшенные версии изображений рецептов и аватаров, '
+        'которые еще не обработаны (например, после сбоя воркера)'
+    )
+
+    def handle(self, *args, **options):
+        processed_count = 0
+        for model_label, (image_field, renditions_field, _) in (
+            IMAGE_PIPELINES.items()
+        ):
+            instances = apps.get_model(model_label).objects.only(
+                'pk', image_field, renditions_field
+            ).iterator()
+            for instance in instances:
+                if needs_processing(instance):
+                    process_image(model_label, instance.pk)
+                    processed_count += 1
+        self.stdout.write(
+            self.style.SUCCESS(f'Обработано изображений: {processed_count}')
+        )
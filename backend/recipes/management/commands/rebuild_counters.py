@@ -0,0 +1,47 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe
+from users.models import Subscription
+
+User = get_user_model()
+
+
+def count_subquery(queryset, field):
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+                field
+            ).annotate(total=Count('pk')).values('total'),
+            output_field=IntegerField()
+        ),
+        0
+    )
+
+
+def rebuild_counters(recipe_model, user_model, favorite_model,
+                     subscription_model):
+    recipe_model.objects.update(
+        favorites_count=count_subquery(favorite_model.objects, 'recipe')
+    )
+    user_model.objects.update(
+        recipes_count=count_subquery(recipe_model.objects, 'author'),
+        subscribers_count=count_subquery(
+            subscription_model.objects, 'author'
+        )
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает счетчики избранного у рецептов, '
+        'рецептов и подписчиков у пользователей'
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild_counters(Recipe, User, Favorite, Subscription)
+        self.stdout.write(self.style.SUCCESS('Счетчики пересчитаны'))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from recipes.models import RecipeIngredient, ShoppingListItem
+
+
+def rebuild_shopping_lists(recipe_ingredient_model, shopping_list_model):
+    shopping_list_model.objects.all().delete()
+    rows = recipe_ingredient_model.objects.filter(
+        recipe__in_shopping_carts__isnull=False
+    ).values(
+        'recipe__in_shopping_carts__user', 'ingredient'
+    ).annotate(total=Sum('amount')).order_by()
+    shopping_list_model.objects.bulk_create(
+        (
+            shopping_list_model(
+                user_id=row['recipe__in_shopping_carts__user'],
+                ingredient_id=row['ingredient'],
+                amount=row['total']
+            )
+            for row in rows.iterator()
+        ),
+        batch_size=1000
+    )
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает списки покупок из корзин пользователей'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild_shopping_lists(RecipeIngredient, ShoppingListItem)
+        self.stdout.write(self.style.SUCCESS('Списки покупок пересобраны'))
@@ -0,0 +1,56 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from api.cache import bump_version
+from recipes.constants import (TRENDING_AGE_OFFSET_HOURS, TRENDING_BATCH_SIZE,
+                               TRENDING_GRAVITY)
+from recipes.models import Recipe
+
+
+def trending_score(favorites_count, carts_count, age_hours):
+    return (favorites_count + carts_count) / (
+        age_hours + TRENDING_AGE_OFFSET_HOURS
+    ) ** TRENDING_GRAVITY
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает рейтинг популярности рецептов: добавления '
+        'в избранное и в корзину с затуханием по дате публикации. '
+        'Запускается периодически, например из cron'
+    )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        rows = Recipe.objects.annotate(
+            carts_count=Count('in_shopping_carts')
+        ).values_list(
+            'id', 'created_at', 'favorites_count', 'carts_count'
+        ).order_by().iterator()
+        updated_count = 0
+        with transaction.atomic():
+            while batch := list(islice(rows, TRENDING_BATCH_SIZE)):
+                Recipe.objects.bulk_update(
+                    (
+                        Recipe(
+                            id=recipe_id,
+                            trending_score=trending_score(
+                                favorites_count,
+                                carts_count,
+                                (now - created_at).total_seconds() / 3600
+                            )
+                        )
+                        for recipe_id, created_at, favorites_count,
+                        carts_count in batch
+                    ),
+                    ('trending_score',)
+                )
+                updated_count += len(batch)
+            bump_version(Recipe._meta.label_lower)
+        self.stdout.write(
+            self.style.SUCCESS(f'Обновлен рейтинг {updated_count} рецептов')
+        )
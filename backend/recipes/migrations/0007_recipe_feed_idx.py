@@ -0,0 +1,17 @@
+# Generated by Django 4.2.22 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_ingredient_name_trgm'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-created_at', 'name', 'id'], name='recipe_feed_idx'),
+        ),
+    ]
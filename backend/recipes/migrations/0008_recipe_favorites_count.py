@@ -0,0 +1,48 @@
+# Generated by Django 4.2.22 on 2026-10-18 17:06
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count_subquery(queryset, field):
+    rows = queryset.filter(
+        **{field: models.OuterRef('pk')}
+    ).order_by().values(field)
+    return Coalesce(
+        models.Subquery(
+            rows.annotate(total=models.Count('pk')).values('total'),
+            output_field=models.IntegerField()
+        ),
+        0
+    )
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    User = apps.get_model('users', 'FoodgramUser')
+    Favorite = apps.get_model('recipes', 'Favorite')
+    Subscription = apps.get_model('users', 'Subscription')
+    Recipe.objects.update(
+        favorites_count=count_subquery(Favorite.objects, 'recipe')
+    )
+    User.objects.update(
+        recipes_count=count_subquery(Recipe.objects, 'author'),
+        subscribers_count=count_subquery(Subscription.objects, 'author')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_feed_idx'),
+        ('users', '0003_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлений в избранное'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.22 on 2026-10-18 17:09
+
+from django.db import migrations, models
+
+
+def fill_updated_at(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Recipe.objects.update(updated_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_trending_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата и время изменения'),
+        ),
+        migrations.RunPython(fill_updated_at, migrations.RunPython.noop),
+    ]
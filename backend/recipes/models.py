@@ -1,6 +1,8 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Upper
 from django.urls import reverse
 
 from recipes.constants import (BIGGER_NAME_LIMIT, MAX_SMALL_INTEGER,
@@ -26,6 +28,12 @@ class Ingredient(models.Model):
                 name='unique_ingredient'
             )
         ]
+        indexes = (
+            GinIndex(
+                OpClass(Upper('name'), name='gin_trgm_ops'),
+                name='ingredient_name_trgm'
+            ),
+        )
 
     def __str__(self):
         return f'{self.name} ({self.measurement_unit})'
@@ -44,6 +52,40 @@ class Tag(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    def with_related(self):
+        """Подгружает автора, теги и ингредиенты одним набором запросов."""
+        return self.select_related('author').prefetch_related(
+            'tags',
+            models.Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient'
+                )
+            )
+        )
+
+    def with_user_annotations(self, user):
+        """Аннотирует рецепты флагами избранного и корзины."""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=models.Value(False),
+                is_in_shopping_cart=models.Value(False),
+            )
+        return self.annotate(
+            is_favorited=models.Exists(
+                Favorite.objects.filter(
+                    user=user, recipe=models.OuterRef('pk')
+                )
+            ),
+            is_in_shopping_cart=models.Exists(
+                ShoppingCart.objects.filter(
+                    user=user, recipe=models.OuterRef('pk')
+                )
+            ),
+        )
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User,
@@ -53,6 +95,9 @@ class Recipe(models.Model):
     )
     name = models.CharField('Название', max_length=BIGGER_NAME_LIMIT)
     image = models.ImageField('Изображение', upload_to='recipes/images/')
+    image_renditions = models.JSONField(
+        'Версии изображения', default=dict, blank=True, editable=False
+    )
     text = models.TextField('Описание')
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -79,15 +124,39 @@ class Recipe(models.Model):
     created_at = models.DateTimeField(
         'Дата и время публикации', auto_now_add=True
     )
+    updated_at = models.DateTimeField(
+        'Дата и время изменения', auto_now=True, db_index=True
+    )
+    favorites_count = models.PositiveIntegerField(
+        'Добавлений в избранное', default=0, editable=False
+    )
+    trending_score = models.FloatField(
+        'Рейтинг популярности', default=0, editable=False
+    )
 
-    @property
-    def favorites_count(self):
-        return self.in_favorites.count()
+    # Меняются только выражениями F() и командами пересчета.
+    COUNTER_FIELDS = ('favorites_count', 'trending_score')
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'рецепты'
         ordering = ('-created_at', 'name')
+        indexes = (
+            models.Index(
+                fields=('-created_at', 'name', 'id'),
+                name='recipe_feed_idx'
+            ),
+            models.Index(
+                fields=('-favorites_count', '-created_at', 'id'),
+                name='recipe_popular_idx'
+            ),
+            models.Index(
+                fields=('-trending_score', '-created_at', 'id'),
+                name='recipe_trending_idx'
+            ),
+        )
 
     def __str__(self):
         return self.name
@@ -95,6 +164,24 @@ class Recipe(models.Model):
     def get_absolute_url(self):
         return reverse('api_s:recipe-detail', kwargs={'pk': self.pk})
 
+    def save_without_counters(self):
+        """
+        Сохраняет изменения рецепта, не записывая счетчики.
+
+        Полное сохранение вернуло бы в БД значения, прочитанные
+        вместе с объектом, и затерло бы параллельные обновления.
+        """
+        self.save(update_fields=[
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key
+            and field.name not in self.COUNTER_FIELDS
+        ])
+
+    def get_ingredient_amounts(self):
+        return dict(
+            self.recipe_ingredients.values_list('ingredient_id', 'amount')
+        )
+
 
 class RecipeIngredient(models.Model):
     recipe = models.ForeignKey(
@@ -187,3 +274,96 @@ class ShoppingCart(models.Model):
                 name='unique_shopping_cart'
             ),
         )
+
+
+class ShoppingListItemQuerySet(models.QuerySet):
+    def apply_amounts(self, user_ids, amounts):
+        """
+        Прибавляет к спискам покупок пользователей количества
+        ингредиентов из словаря {ingredient_id: amount}.
+        Отрицательные значения уменьшают позиции, обнулившиеся удаляются.
+        """
+        user_ids = list(user_ids)
+        amounts = {
+            ingredient_id: amount
+            for ingredient_id, amount in amounts.items() if amount
+        }
+        if not user_ids or not amounts:
+            return
+        with transaction.atomic():
+            self.bulk_create(
+                (
+                    self.model(
+                        user_id=user_id, ingredient_id=ingredient_id, amount=0
+                    )
+                    for user_id in user_ids
+                    for ingredient_id, amount in amounts.items()
+                    if amount > 0
+                ),
+                ignore_conflicts=True
+            )
+            items = list(self.filter(
+                user_id__in=user_ids, ingredient_id__in=amounts
+            ).only('id', 'ingredient_id'))
+            for item in items:
+                item.amount = (
+                    models.F('amount') + amounts[item.ingredient_id]
+                )
+            self.bulk_update(items, ('amount',))
+            self.filter(user_id__in=user_ids, amount__lte=0).delete()
+
+    def apply_recipes(self, user_ids, recipe_ids, sign=1):
+        """
+        Добавляет (sign=1) или убирает (sign=-1) ингредиенты
+        нескольких рецептов одним агрегирующим запросом.
+        """
+        amounts = RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('ingredient_id').annotate(
+            total=models.Sum('amount')
+        ).order_by()
+        self.apply_amounts(
+            user_ids,
+            {ingredient_id: sign * total for ingredient_id, total in amounts}
+        )
+
+    def remove_recipe(self, user_ids, recipe):
+        self.apply_amounts(
+            user_ids,
+            {
+                ingredient_id: -amount
+                for ingredient_id, amount
+                in recipe.get_ingredient_amounts().items()
+            }
+        )
+
+
+class ShoppingListItem(models.Model):
+    """Суммарное количество ингредиента в корзине пользователя."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент'
+    )
+    amount = models.PositiveIntegerField('Количество')
+
+    objects = ShoppingListItemQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Списки покупок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_list_item'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} - {self.amount}'
@@ -0,0 +1,86 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from users.models import Subscription
+
+User = get_user_model()
+
+RECIPES_COUNT = 12
+# Фиксированная стоимость страницы ленты: не зависит от limit.
+AUTHENTICATED_QUERIES = 7
+ANONYMOUS_QUERIES = 5
+
+
+class RecipeListQueriesTest(TestCase):
+    """Число запросов к /api/recipes/ не растет с размером страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                email=f'user{index}@example.com',
+                username=f'user{index}',
+                first_name='Имя',
+                last_name='Фамилия',
+                password='password-12345'
+            )
+            for index in range(3)
+        ]
+        tags = [
+            Tag.objects.create(name=f'Тег {index}', slug=f'tag{index}')
+            for index in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {index}', measurement_unit='г'
+            )
+            for index in range(5)
+        ]
+        for index in range(RECIPES_COUNT):
+            recipe = Recipe.objects.create(
+                author=cls.users[index % len(cls.users)],
+                name=f'Рецепт {index}',
+                text='Описание',
+                cooking_time=10,
+                image='recipes/images/recipe.png'
+            )
+            recipe.tags.set(tags[:index % len(tags) + 1])
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe=recipe, ingredient=ingredient, amount=index + 1
+                )
+                for ingredient in ingredients
+            )
+            Favorite.objects.create(user=cls.users[0], recipe=recipe)
+            ShoppingCart.objects.create(user=cls.users[0], recipe=recipe)
+        Subscription.objects.create(user=cls.users[0], author=cls.users[1])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def assert_page_queries(self, count, limit):
+        if connection.vendor == 'postgresql':
+            # Оценка числа рецептов из pg_class перед COUNT(*).
+            count += 1
+        cache.clear()
+        with self.assertNumQueries(count):
+            response = self.client.get('/api/recipes/', {'limit': limit})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), limit)
+
+    def test_authenticated_list(self):
+        self.client.force_authenticate(self.users[0])
+        for limit in (2, 10):
+            with self.subTest(limit=limit):
+                self.assert_page_queries(AUTHENTICATED_QUERIES, limit)
+
+    def test_anonymous_list(self):
+        for limit in (2, 10):
+            with self.subTest(limit=limit):
+                self.assert_page_queries(ANONYMOUS_QUERIES, limit)
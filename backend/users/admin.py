@@ -11,18 +11,10 @@ User = get_user_model()
 class CustomUserAdmin(UserAdmin):
     list_display = (
         'username', 'email', 'first_name', 'last_name',
-        'get_subscribers_count', 'get_recipes_count'
+        'subscribers_count', 'recipes_count'
     )
     search_fields = ('username', 'email')
-    readonly_fields = ('get_subscribers_count', 'get_recipes_count')
-
-    @admin.display(description='Кол-во подписчиков')
-    def get_subscribers_count(self, obj):
-        return obj.following.count()
-
-    @admin.display(description='Кол-во рецептов')
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
+    readonly_fields = ('subscribers_count', 'recipes_count')
 
 
 admin.site.register(Subscription)
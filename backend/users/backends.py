@@ -1,14 +1,76 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
 from django.contrib.auth import get_user_model
 from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import check_password, make_password
+from django.db import close_old_connections
+from django.db.models.functions import Lower
+
+from users.constants import PASSWORD_REHASH_WORKERS
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
+
+rehash_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_REHASH_WORKERS, thread_name_prefix='rehash'
+)
+
+
+def rehash_password(user_id, old_hash, raw_password):
+    """
+    Перехеширует пароль с текущими параметрами хешера.
+
+    Пароль обновляется, только если его не успели сменить.
+    """
+    close_old_connections()
+    try:
+        User.objects.filter(pk=user_id, password=old_hash).update(
+            password=make_password(raw_password)
+        )
+    except Exception:
+        logger.exception('Не удалось перехешировать пароль %s', user_id)
+    finally:
+        close_old_connections()
 
 
 class EmailAuthBackend(ModelBackend):
+    """
+    Вход по email без учета регистра.
+
+    Единственный бэкенд проекта: на неудачный вход тратится ровно
+    одно вычисление хеша, в том числе для несуществующего email.
+    Пароли со старыми параметрами хешера перехешируются в фоне,
+    не задерживая ответ.
+    """
+
+    def get_user_by_email(self, email):
+        users = User.objects.alias(
+            email_lower=Lower('email')
+        ).filter(email_lower=email.lower())
+        try:
+            return users.get()
+        except User.MultipleObjectsReturned:
+            return users.filter(email=email).first()
+
     def authenticate(self, request, username=None, password=None, **kwargs):
+        email = username or kwargs.get('email')
+        if email is None or password is None:
+            return None
         try:
-            user = User.objects.get(email=username or kwargs.get('email'))
-            if user.check_password(password):
-                return user
+            user = self.get_user_by_email(email)
         except User.DoesNotExist:
+            user = None
+        if user is None:
+            # Выравниваем время ответа с проверкой существующего пароля.
+            User().set_password(password)
             return None
+        if check_password(
+            password,
+            user.password,
+            setter=lambda raw_password: rehash_executor.submit(
+                rehash_password, user.pk, user.password, raw_password
+            )
+        ) and self.user_can_authenticate(user):
+            return user
+        return None
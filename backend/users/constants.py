@@ -1,2 +1,3 @@
 MAX_EMAIL_LENGTH = 254
 MAX_NAME_LENGTH = 150
+PASSWORD_REHASH_WORKERS = 1
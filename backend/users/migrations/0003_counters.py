@@ -0,0 +1,23 @@
+# Generated by Django 4.2.22 on 2026-10-18 17:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_alter_foodgramuser_avatar'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foodgramuser',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Кол-во рецептов'),
+        ),
+        migrations.AddField(
+            model_name='foodgramuser',
+            name='subscribers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Кол-во подписчиков'),
+        ),
+    ]
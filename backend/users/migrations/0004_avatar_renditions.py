@@ -0,0 +1,18 @@
+# Generated by Django 4.2.22 on 2026-10-18 17:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foodgramuser',
+            name='avatar_renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Версии аватара'),
+        ),
+    ]
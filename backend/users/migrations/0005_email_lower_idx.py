@@ -0,0 +1,18 @@
+# Generated by Django 4.2.22 on 2026-10-18 17:20
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_avatar_renditions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='foodgramuser',
+            index=models.Index(django.db.models.functions.text.Lower('email'), name='user_email_lower_idx'),
+        ),
+    ]
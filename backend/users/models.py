@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.core.validators import RegexValidator
 from django.db import models
+from django.db.models.functions import Lower
 
 from users.constants import MAX_EMAIL_LENGTH, MAX_NAME_LENGTH
 
@@ -67,6 +68,15 @@ class FoodgramUser(AbstractUser):
         blank=True,
         null=True
     )
+    avatar_renditions = models.JSONField(
+        'Версии аватара', default=dict, blank=True, editable=False
+    )
+    recipes_count = models.PositiveIntegerField(
+        'Кол-во рецептов', default=0, editable=False
+    )
+    subscribers_count = models.PositiveIntegerField(
+        'Кол-во подписчиков', default=0, editable=False
+    )
     objects = CustomUserManager()
 
     USERNAME_FIELD = 'email'
@@ -75,6 +85,9 @@ class FoodgramUser(AbstractUser):
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
+        indexes = (
+            models.Index(Lower('email'), name='user_email_lower_idx'),
+        )
 
     def __str__(self):
         return self.username